@@ -1,15 +1,35 @@
+import copy
 import io
+import itertools
 import json
+import posixpath
 import re
+import struct
 import time
 import zipfile
-import xml.etree.ElementTree as ET
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import streamlit as st
 from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
 from difflib import SequenceMatcher
+from functools import lru_cache
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    fuzz = process = None
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 # ── Page meta / theme ────────────────────────────────────────────────
 st.set_page_config(page_title="Masterfile Automation - Target", page_icon="🎯", layout="wide", initial_sidebar_state="collapsed")
@@ -33,46 +53,86 @@ MASTER_DISPLAY_ROW    = 1
 MASTER_SECONDARY_ROW  = 2
 MASTER_DATA_START_ROW = 3
 
+# ── Onboarding reader engine (Rust-backed calamine when installed) ───
+try:
+    from python_calamine import CalamineWorkbook
+    ONBOARDING_ENGINE = "calamine"
+except ImportError:
+    CalamineWorkbook = None
+    ONBOARDING_ENGINE = "openpyxl"
+
 # ── XML namespaces ───────────────────────────────────────────────────
 XL_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
 XL_NS_REL  = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
-ET.register_namespace("", XL_NS_MAIN)
+XL_NS_MC   = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+XL_NS_X14AC = "http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac"
+XML_LXML = hasattr(ET, "LXML_VERSION")
+if XML_LXML:
+    # libxml2 keeps each part's own prefixes; uploaded parts are parsed without entity expansion
+    _XML_PARSER = ET.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+    def xml_fromstring(b: bytes): return ET.fromstring(b, _XML_PARSER)
+    def xml_iterparse(f): return ET.iterparse(f, events=("end",), resolve_entities=False, no_network=True, huge_tree=True)
+else:
+    xml_fromstring = ET.fromstring
+    def xml_iterparse(f): return ET.iterparse(f, events=("end",))
+    ET.register_namespace("", XL_NS_MAIN)
 ET.register_namespace("r", XL_NS_REL)
-ET.register_namespace("mc", "http://schemas.openxmlformats.org/markup-compatibility/2006")
-ET.register_namespace("x14ac", "http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac")
+ET.register_namespace("mc", XL_NS_MC)
+ET.register_namespace("x14ac", XL_NS_X14AC)
 
 # ── Helpers ─────────────────────────────────────────────────────────
+def json_loads(data):
+    # orjson when installed; anything it rejects (BOM, UTF-16, NaN) falls back to stdlib for the same result/error
+    if orjson is not None:
+        try: return orjson.loads(data)
+        except orjson.JSONDecodeError: pass
+    return json.loads(data)
 _INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F\uD800-\uDFFF]")
-def sanitize_xml_text(s): return "" if s is None else _INVALID_XML_CHARS.sub("", str(s))
-def norm(s: str) -> str:
-    if s is None: return ""
-    x = str(s).strip().lower()
-    x = re.sub(r"\s*-\s*en\s*[-_ ]\s*us\s*$", "", x)
-    x = x.replace("–","-").replace("—","-").replace("−","-")
-    x = re.sub(r"[._/\\-]+", " ", x)
-    x = re.sub(r"[^0-9a-z\s]+", " ", x)
-    return re.sub(r"\s+", " ", x).strip()
-def top_matches(query, candidates, k=3):
-    q = norm(query)
-    scored = [(SequenceMatcher(None, q, norm(c)).ratio(), c) for c in candidates]
-    scored.sort(key=lambda t: t[0], reverse=True)
-    return scored[:k]
+_NORM_EN_US = re.compile(r"\s*-\s*en\s*[-_ ]\s*us\s*$")
+_NORM_TOKEN = re.compile(r"[0-9a-z]+")
+def norm(s) -> str:
+    # any value (mapping JSON may hold lists, numbers...) is str()'d first, so the cache is keyed on the text
+    return "" if s is None else _norm_str(str(s))
+@lru_cache(maxsize=4096)
+def _norm_str(s: str) -> str:
+    # drop a trailing "- en-US", then keep the ascii alnum runs; every separator, dash or other char splits
+    return " ".join(_NORM_TOKEN.findall(_NORM_EN_US.sub("", s.strip().lower())))
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # k best by score (ties → lower index first) without sorting the whole row
+    n = len(scores)
+    if n <= k: return np.argsort(-scores, kind="stable")
+    kth = np.partition(scores, n - k)[n - k]
+    idx = np.flatnonzero(scores >= kth)
+    return idx[np.argsort(-scores[idx], kind="stable")][:k]
+def top_matches_many(queries, candidates, k=3) -> list[list[tuple[float, str]]]:
+    qs = [norm(q) for q in queries]; cs = [norm(c) for c in candidates]
+    if not qs or not cs: return [[] for _ in qs]
+    if process is not None: sim = process.cdist(qs, cs, scorer=fuzz.ratio, workers=-1) / 100.0
+    else: sim = np.array([[SequenceMatcher(None, q, c).ratio() for c in cs] for q in qs])
+    return [[(float(row[j]), candidates[j]) for j in top_k_indices(row, k)] for row in sim]
+@st.cache_data(show_spinner=False)
+def top_matches_cached(queries: tuple, candidates: tuple, k: int = 3) -> list[list[tuple[float, str]]]:
+    return top_matches_many(list(queries), list(candidates), k)
 def nonempty_rows(df: pd.DataFrame) -> int:
     if df.empty: return 0
-    return df.replace("", pd.NA).dropna(how="all").shape[0]
-def worksheet_used_cols(ws, header_rows=(1,), hard_cap=2048, empty_streak_stop=8):
-    max_try = min(ws.max_column, hard_cap); last_nonempty=0; streak=0
+    arr = df.to_numpy(dtype=object)
+    return int(((arr != "") & pd.notna(arr)).any(axis=1).sum())
+def header_used_cols(header_vals, max_cols: int, hard_cap=2048, empty_streak_stop=8) -> int:
+    # header_vals: one sequence of cell values per header row
+    max_try = min(max_cols, hard_cap); last_nonempty=0; streak=0
     for c in range(1, max_try + 1):
-        any_val = any((ws.cell(row=r, column=c).value not in (None, "")) for r in header_rows)
+        any_val = any(c <= len(vals) and vals[c-1] not in (None, "") for vals in header_vals)
         if any_val: last_nonempty, streak = c, 0
         else:
             streak += 1
             if streak >= empty_streak_stop: break
     return max(last_nonempty, 1)
+@lru_cache(maxsize=4096)
 def _col_letter(n: int) -> str:
     s=""; 
     while n: n,r=divmod(n-1,26); s=chr(65+r)+s
     return s
+@lru_cache(maxsize=4096)
 def _col_number(letters: str) -> int:
     n=0
     for ch in letters:
@@ -84,14 +144,145 @@ def safe_filename(name: str, fallback: str = "final_masterfile"):
     name = re.sub(r"[^A-Za-z0-9._ -]+", "", name.strip())
     return name or fallback
 
+# ── Onboarding loading (cached across reruns, keyed on file bytes) ──
+def _header_text(v) -> str:
+    # same text pandas gives the column: whole floats read back as ints
+    if isinstance(v, float) and v.is_integer(): v = int(v)
+    return str(v).strip()
+@st.cache_data(show_spinner=False)
+def _onboarding_headers(file_bytes: bytes) -> dict[str, list[str]]:
+    headers = {}
+    if CalamineWorkbook is not None:
+        # one archive open; physical row 1 of each sheet (the row read_excel(header=0) uses), no DataFrame per sheet
+        wb = CalamineWorkbook.from_filelike(io.BytesIO(file_bytes))
+        for sheet in wb.sheet_names:
+            try:
+                first = next(iter(wb.get_sheet_by_name(sheet).to_python(skip_empty_area=False, nrows=1)), [])
+            except Exception:
+                continue
+            headers[sheet] = [_header_text(v) for v in first if v != ""]
+        return headers
+    # no calamine: row 1 only from openpyxl's read-only row stream; an empty row 1 means no headers
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True, keep_links=False)
+    try:
+        for sheet in wb.sheetnames:
+            try:
+                first = next(wb[sheet].iter_rows(min_row=1, max_row=1, values_only=True), ())
+            except Exception:
+                continue
+            headers[sheet] = [_header_text(v) for v in first if v not in (None, "")]
+    finally:
+        wb.close()
+    return headers
+@st.cache_data(show_spinner=False)
+def _load_onboarding_sheet(file_bytes: bytes, sheet: str | int, nrows: int | None = None) -> pd.DataFrame:
+    # sheet: name, or position in the workbook (0 = first sheet)
+    df = pd.read_excel(io.BytesIO(file_bytes), sheet_name=sheet, header=0, dtype=str, nrows=nrows, engine=ONBOARDING_ENGINE).fillna("")
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+# ── Template header metadata (cached, keyed on file bytes) ───────────
+@st.cache_data(show_spinner=False)
+def _template_headers(master_bytes: bytes) -> tuple[list[str], int, list, list]:
+    # straight from the sheet XML (streamed only up to the header rows); no openpyxl workbook load
+    with zipfile.ZipFile(io.BytesIO(master_bytes)) as z:
+        sheetnames = _workbook_sheet_names(z)
+        if MASTER_TEMPLATE_SHEET not in sheetnames: return sheetnames, 0, [], []
+        header_rows = (MASTER_DISPLAY_ROW, MASTER_SECONDARY_ROW)
+        rows, dim_cols = _read_headers_from_sheet_xml(z, _find_sheet_part_path(z, MASTER_TEMPLATE_SHEET), header_rows)
+    header_vals = [rows.get(r, []) for r in header_rows]
+    used_cols = header_used_cols(header_vals, dim_cols or max(map(len, header_vals)))
+    pad_row = lambda vals: [v or "" for v in vals[:used_cols]] + [""] * (used_cols - len(vals))
+    return sheetnames, used_cols, pad_row(header_vals[0]), pad_row(header_vals[1])
+
+# ── Vectorized pattern helpers (one column of cells at a time) ───────
+def _compile_pats(pats_by_label: dict) -> dict[str, tuple[re.Pattern, list[re.Pattern]]]:
+    # per label: (one alternation of all its patterns, the patterns themselves); no re.I, text is lowercased up front
+    return {label: (re.compile("|".join(f"(?:{p})" for p in pats)), [re.compile(p) for p in pats])
+            for label, pats in pats_by_label.items()}
+def _rx_mask(vals: list[str], rx: re.Pattern) -> np.ndarray:
+    # plain search loop: str.contains would warn on every pattern with capture groups
+    search = rx.search
+    return np.fromiter((search(t) is not None for t in vals), dtype=bool, count=len(vals))
+def _rx_hits(vals: list[str], pats: tuple) -> np.ndarray:
+    # per cell: how many distinct patterns match; the alternation scans every cell once and
+    # only cells it hits are searched pattern by pattern
+    any_rx, rxs = pats
+    hit = _rx_mask(vals, any_rx)
+    if len(rxs) == 1: return hit.astype(np.int64)
+    hits = np.zeros(len(vals), dtype=np.int64)
+    idx = np.flatnonzero(hit)
+    if idx.size:
+        sub = [vals[i] for i in idx.tolist()]
+        for rx in rxs: hits[idx] += _rx_mask(sub, rx)
+    return hits
+_WORD_RUN_PAT     = re.compile(r"\\b([a-z0-9]+(?:\\W\+[a-z0-9]+)*)\\b")  # \bjoint\W+health\b, \bmood\b
+_WORD_LITERAL_PAT = re.compile(r"\\b([a-z0-9]+(?:\\ [a-z0-9]+)+)\\b")   # \bpeanut\ butter\b
+_NON_WORD_RUN = re.compile(r"\W+")
+def _automaton(words: dict):
+    if not words: return None
+    auto = ahocorasick.Automaton()
+    for word, js in words.items(): auto.add_word(word, (len(word), js))
+    auto.make_automaton()
+    return auto
+def _pattern_table(pats_by_label: dict, labels: list[str]) -> tuple:
+    # plain word patterns go into Aho-Corasick automata (when pyahocorasick is installed): word runs joined
+    # by \W+ are matched on the text with every non-word run collapsed to one space, literal phrases on
+    # the raw text; everything else stays a compiled regex, per label index, behind one alternation of
+    # all of them that picks out the cells worth searching label by label
+    raw, runs, rest, other_all = {}, {}, {}, []
+    for j, label in enumerate(labels):
+        other = []
+        for p in pats_by_label[label]:
+            if ahocorasick is not None and (m := _WORD_RUN_PAT.fullmatch(p)):
+                runs.setdefault(m.group(1).replace("\\W+", " "), []).append(j)
+            elif ahocorasick is not None and (m := _WORD_LITERAL_PAT.fullmatch(p)):
+                raw.setdefault(m.group(1).replace("\\ ", " "), []).append(j)
+            else: other.append(p)
+        if other: rest[j] = _compile_pats({label: other})[label]; other_all += other
+    rest_any = _compile_pats({"": other_all})[""][0] if other_all else None
+    return _automaton(raw), _automaton(runs), (rest_any, rest), len(labels)
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+def _ac_words(auto, t: str, found: dict):
+    # keep hits with non-word chars on both sides, i.e. what \b...\b would accept
+    for end, (size, js) in auto.iter(t):
+        start = end - size + 1
+        if (start == 0 or not _is_word_char(t[start - 1])) and (end + 1 == len(t) or not _is_word_char(t[end + 1])):
+            found[id(js)] = js
+def _table_hits(vals: list[str], table: tuple) -> np.ndarray:
+    # (cells x labels): per cell, how many distinct patterns of each label match
+    raw, runs, (rest_any, rest), n_labels = table
+    hits = np.zeros((len(vals), n_labels), dtype=np.int64)
+    if raw is not None or runs is not None:
+        for i, t in enumerate(vals):
+            found = {}
+            if raw is not None: _ac_words(raw, t, found)
+            if runs is not None: _ac_words(runs, _NON_WORD_RUN.sub(" ", t), found)
+            for js in found.values():
+                for j in js: hits[i, j] += 1
+    if rest:
+        idx = np.flatnonzero(_rx_mask(vals, rest_any))
+        sub = [vals[i] for i in idx.tolist()]
+        for j, pats in rest.items(): hits[idx, j] += _rx_hits(sub, pats)
+    return hits
+def seo_column_text(df: pd.DataFrame, ordered_cols: list[str]) -> dict[str, list[str]]:
+    # each SEO column as a plain list of lowercased str, converted once and shared by every column-wise
+    # inference; all inference patterns are lowercase and compiled without re.I
+    return {c: df[c].astype(str).str.lower().tolist() for c in ordered_cols}
+def _top_labels(scores: np.ndarray, labels: list[str], k: int, min_score: float = 1) -> list[list[str]]:
+    # per row: up to k labels scoring >= min_score, best first, ties by label order; labels must be sorted
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    top = np.take_along_axis(scores, order, axis=1)
+    return [[labels[j] for j, v in zip(oi, ov) if v >= min_score] for oi, ov in zip(order.tolist(), top.tolist())]
+def _join_top_labels(scores: np.ndarray, labels: list[str], k: int) -> list[str]:
+    return ["|".join(picks) for picks in _top_labels(scores, labels, k)]
+
 # ── Gender inference ─────────────────────────────────────────────────
 _APOS = r"[’']"
-_GENDER_W = re.compile(rf"\b(women(?:{_APOS}s)?|woman|female|lad(?:y|ies))\b", re.I)
-_GENDER_M = re.compile(rf"\b(men(?:{_APOS}s)?|man|male|gent(?:lemen)?)\b", re.I)
-_UNISEX   = re.compile(r"\b(unisex|all genders|everyone|for all|men\s*&\s*women|women\s*&\s*men)\b", re.I)
-def _has_w(text: str) -> bool: return bool(_GENDER_W.search((text or "")))
-def _has_m(text: str) -> bool: return bool(_GENDER_M.search((text or "")))
-def _is_unisex(text: str) -> bool: return bool(_UNISEX.search((text or "").lower()))
+_GENDER_W = re.compile(rf"\b(?:women(?:{_APOS}s)?|woman|female|lad(?:y|ies))\b")
+_GENDER_M = re.compile(rf"\b(?:men(?:{_APOS}s)?|man|male|gent(?:lemen)?)\b")
+_UNISEX   = re.compile(r"\b(?:unisex|all genders|everyone|for all|men\s*&\s*women|women\s*&\s*men)\b")
 
 # ── SEO field aliases (provided) ─────────────────────────────────────
 SEO_ALIASES = {
@@ -103,21 +294,23 @@ SEO_ALIASES = {
     "bullet_point4": ["Bullet point 4","bullet_point4", "Bullet Feature 4", "bullet point 4", "bullet_point4 - en-US", "Key Features #4 - en-US"],
     "bullet_point5": ["Bullet point 5","bullet_point5", "Bullet Feature 5", "bullet point 5", "bullet_point5 - en-US", "Key Features #5 - en-US"],
 }
+_SEO_ALIASES_NORM = {field: tuple(norm(a) for a in aliases) for field, aliases in SEO_ALIASES.items()}
+_SEO_HEURISTIC = re.compile("|".join(["title","product name","description","bullet","feature","name"]))
 def select_seo_columns(df: pd.DataFrame) -> list[str]:
-    header_lookup = {norm(c): c for c in df.columns}
+    normed = [(c, norm(c)) for c in df.columns]
+    header_lookup = {n: c for c, n in normed}
     picks = []
-    for _, aliases in SEO_ALIASES.items():
-        for alias in aliases:
-            key = norm(alias)
+    for alias_keys in _SEO_ALIASES_NORM.values():
+        for key in alias_keys:
             if key in header_lookup:
                 picks.append(header_lookup[key])
                 break
-    seen = set()
-    picks = [c for c in picks if not (c in seen or seen.add(c))]
+    picks = list(dict.fromkeys(picks))
     if picks:
         return picks
-    heur = [c for c in df.columns if any(k in norm(c) for k in ["title","product name","description","bullet","feature","name"])]
+    heur = [c for c, n in normed if _SEO_HEURISTIC.search(n)]
     return heur if heur else list(df.columns)
+@lru_cache(maxsize=1024)
 def _column_priority_score(col_name: str) -> int:
     n = norm(col_name)
     if "title" in n or "product name" in n: return 3
@@ -127,63 +320,52 @@ def _column_priority_score(col_name: str) -> int:
 def order_seo_columns(cols: list[str]) -> list[str]:
     return sorted(cols, key=_column_priority_score, reverse=True)
 
-def infer_gender_from_columns(row: pd.Series, ordered_cols: list[str]) -> str:
-    for c in ordered_cols:
-        t = str(row.get(c, ""))
-        if _is_unisex(t):
-            return "Gender Neutral"
-    any_w = False; any_m = False
-    for c in ordered_cols:
-        t = str(row.get(c, ""))
-        w = _has_w(t); m = _has_m(t)
-        any_w = any_w or w
-        any_m = any_m or m
-        if w and not m:
-            return "Women"
-        if m and not w:
-            return "Men"
-    if any_w and any_m: return "Gender Neutral"
-    if any_w: return "Women"
-    if any_m: return "Men"
-    return "Gender Neutral"
+def infer_gender_series(seo_text: dict[str, list[str]], index: pd.Index) -> pd.Series:
+    # column-at-a-time: any unisex hit → neutral; else the first column (in priority order)
+    # that names exactly one gender decides; columns naming both/neither leave it neutral
+    n = len(index)
+    out = np.full(n, "Gender Neutral", dtype=object)
+    unisex = np.zeros(n, dtype=bool); decided = np.zeros(n, dtype=bool)
+    for vals in seo_text.values():
+        # rows already unisex are settled; rows already decided only still need the unisex check
+        idx = np.flatnonzero(~unisex)
+        unisex[idx[_rx_mask([vals[i] for i in idx.tolist()], _UNISEX)]] = True
+        idx = np.flatnonzero(~unisex & ~decided)
+        if not idx.size: continue
+        sub = [vals[i] for i in idx.tolist()]
+        w = _rx_mask(sub, _GENDER_W); m = _rx_mask(sub, _GENDER_M)
+        out[idx[w & ~m]] = "Women"; out[idx[m & ~w]] = "Men"
+        decided[idx[w ^ m]] = True
+    out[unisex] = "Gender Neutral"
+    return pd.Series(out, index=index)
 
 # ── Health & Beauty Subtype (≤3) ─────────────────────────────────────
-_EXCLUDE_NON_POWDER = re.compile(r"\b(protein\s+bar|protein\s+cookie|protein\s+shake|ready[-\s]?to[-\s]?drink|rtd)\b", re.I)
+_EXCLUDE_NON_POWDER = re.compile(r"\b(protein\s+bar|protein\s+cookie|protein\s+shake|ready[-\s]?to[-\s]?drink|rtd)\b")
 _HB_SUBTYPE_PATTERNS = {
     "Collagen": [r"\bcollagen\b", r"\bcollagen\s+peptid(e|es)\b", r"\bhydrol(y|i)zed\s+collagen\b", r"\bmarine\s+collagen\b", r"\btype\s*(i|ii|iii)\b"],
     "Protein Powder": [r"\bprotein\s+powder\b", r"\bwhey\b", r"\bcasein\b", r"\bmicellar\s+casein\b", r"\b(isolate|concentrate)\b", r"\bpea\s+protein\b", r"\bsoy\s+protein\b", r"\brice\s+protein\b", r"\bprotein\s+blend\b"],
     "Multivitamins": [r"\bmult(i|i-)?vitamin(s)?\b", r"\bdaily\s+multivitamin(s)?\b", r"\bmulti[-\s]?vit\b"],
     "Vitamin A": [r"\bvit(amin)?\s*a\b", r"\bretinol\b", r"\bretinyl\b"],
-    "Vitamin B": [r"\bvit(amin)?\s*b(\d{1,2})?\b", r"\bb[-\s]?complex\b", r"\bthiamin(e)?\b", r"\briboflavin\b", r"\bniacin(amide)?\b", r"\bpantothenic\b", r"\bpyridoxin(e)?\b", r"\bbiotin\b", r"\bfolate\b", r"\bfolic\s+acid\b", r"\bcobalamin\b", r"\bB-?12\b", r"\bB-?6\b", r"\bB-?3\b"],
+    "Vitamin B": [r"\bvit(amin)?\s*b(\d{1,2})?\b", r"\bb[-\s]?complex\b", r"\bthiamin(e)?\b", r"\briboflavin\b", r"\bniacin(amide)?\b", r"\bpantothenic\b", r"\bpyridoxin(e)?\b", r"\bbiotin\b", r"\bfolate\b", r"\bfolic\s+acid\b", r"\bcobalamin\b", r"\bb-?12\b", r"\bb-?6\b", r"\bb-?3\b"],
     "Vitamin C": [r"\bvit(amin)?\s*c\b", r"\bascorb(ic|ate)\b", r"\bester[-\s]?c\b"],
     "Vitamin D": [r"\bvit(amin)?\s*d\b", r"\bd-?3\b", r"\bd-?2\b", r"\bcholecalciferol\b", r"\bergocalciferol\b"],
     "Vitamin E": [r"\bvit(amin)?\s*e\b", r"\btocopherol\b", r"\btocotrienol\b"],
     "Vitamin K": [r"\bvit(amin)?\s*k\b", r"\bk-?2\b", r"\bmk-?\s?7\b", r"\bmenaquinone\b", r"\bphylloquinone\b"],
 }
-def _hb_score_patterns(text: str, patterns: list[str]) -> int:
-    if not text: return 0
-    return sum(1 for p in patterns if re.search(p, text, re.I))
-def infer_hb_subtype_from_columns(row: pd.Series, ordered_cols: list[str]) -> str:
-    scores = {k: 0 for k in _HB_SUBTYPE_PATTERNS.keys()}
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt:
-            continue
+_HB_SUBTYPE_RX = _compile_pats(_HB_SUBTYPE_PATTERNS)
+_HB_LABELS = sorted(_HB_SUBTYPE_PATTERNS)
+_PROTEIN_POWDER_RX = re.compile(r"\bprotein\s+powder\b")
+def infer_hb_subtype_series(seo_text: dict[str, list[str]], index: pd.Index) -> pd.Series:
+    scores = np.zeros((len(index), len(_HB_LABELS)), dtype=np.int64)
+    for c, vals in seo_text.items():
         weight = _column_priority_score(c)
-        protein_powder_ok = True
-        if _EXCLUDE_NON_POWDER.search(txt) and not re.search(r"\bprotein\s+powder\b", txt, re.I):
-            protein_powder_ok = False
-        for label, pats in _HB_SUBTYPE_PATTERNS.items():
-            if label == "Protein Powder" and not protein_powder_ok:
-                continue
-            hits = _hb_score_patterns(txt, pats)
-            if hits:
-                scores[label] += weight * hits
-    picks = [(k, v) for k, v in scores.items() if v > 0]
-    if not picks:
-        return ""
-    picks.sort(key=lambda kv: (-kv[1], kv[0]))
-    return "|".join([k for k, _ in picks[:3]])
+        if not weight: continue
+        protein_powder_ok = ~_rx_mask(vals, _EXCLUDE_NON_POWDER) | _rx_mask(vals, _PROTEIN_POWDER_RX)
+        for j, label in enumerate(_HB_LABELS):
+            hits = _rx_hits(vals, _HB_SUBTYPE_RX[label])
+            if label == "Protein Powder": hits *= protein_powder_ok
+            scores[:, j] += weight * hits
+    return pd.Series(_join_top_labels(scores, _HB_LABELS, 3), index=index)
 
 # ── Health Application* (≤5) ─────────────────────────────────────────
 _HEALTH_APP_LABELS = [
@@ -238,7 +420,7 @@ _HEALTH_APP_SYNONYMS = {
     "Children's Health": [r"\b(children|kids|child)\b.*\bhealth\b", r"\bfor\s+(kids|children)\b"],
     "Men's Health": [r"\b(men|male)\b.*\bhealth\b", r"\bfor\s+men\b"],
     "Women's Health": [r"\b(women|female)\b.*\bhealth\b", r"\bfor\s+women\b"],
-    "Irritable Bowel Syndrome (IBS)": [r"\birritable\s+bowel\s+syndrome\b", r"\bIBS\b"],
+    "Irritable Bowel Syndrome (IBS)": [r"\birritable\s+bowel\s+syndrome\b", r"\bibs\b"],
     "eye health": [r"\beye\s+health\b", r"\bvision\b", r"\bocular\b"],
     "Nervous System Health": [r"\bnervous\s+system\b", r"\bneurolog(y|ical)\b"],
     "Respiratory Health": [r"\brespiratory\b", r"\blung\b", r"\bbreath(ing)?\b"],
@@ -248,30 +430,18 @@ _HEALTH_APP_SYNONYMS = {
     "Mood": [r"\bmood\b"],
     "Metabolism": [r"\bmetaboli[sc]m\b"],
 }
-_HEALTH_APP_REGEX = {}
-for label in _HEALTH_APP_LABELS:
-    pats = [ _make_base_pat(label) ]
-    pats.extend(_HEALTH_APP_SYNONYMS.get(label, []))
-    _HEALTH_APP_REGEX[label] = [re.compile(p, re.I) for p in pats]
-def _health_score(text: str, comp_list) -> int:
-    if not text: return 0
-    return sum(1 for rx in comp_list if rx.search(text))
-def infer_health_app_from_columns(row: pd.Series, ordered_cols: list[str]) -> str:
-    scores = {label:0 for label in _HEALTH_APP_REGEX.keys()}
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt: 
-            continue
+_HEALTH_APP_PATTERNS = {label: [_make_base_pat(label), *_HEALTH_APP_SYNONYMS.get(label, [])] for label in _HEALTH_APP_LABELS}
+_HEALTH_LABELS_SORTED = sorted(_HEALTH_APP_PATTERNS)
+@lru_cache(maxsize=None)   # built on first inference, not on every widget rerun
+def _health_app_table() -> tuple: return _pattern_table(_HEALTH_APP_PATTERNS, _HEALTH_LABELS_SORTED)
+def infer_health_app_series(seo_text: dict[str, list[str]], index: pd.Index) -> pd.Series:
+    scores = np.zeros((len(index), len(_HEALTH_LABELS_SORTED)), dtype=np.int64)
+    table = _health_app_table()
+    for c, vals in seo_text.items():
         weight = _column_priority_score(c)
-        for label, comp_list in _HEALTH_APP_REGEX.items():
-            hits = _health_score(txt, comp_list)
-            if hits:
-                scores[label] += weight * hits
-    picks = [(k, v) for k, v in scores.items() if v > 0]
-    if not picks:
-        return ""
-    picks.sort(key=lambda kv: (-kv[1], kv[0]))
-    return "|".join([k for k, _ in picks[:5]])
+        if not weight: continue
+        scores += weight * _table_hits(vals, table)
+    return pd.Series(_join_top_labels(scores, _HEALTH_LABELS_SORTED, 5), index=index)
 
 # ── Targeted Audience* (single; default Adult) ───────────────────────
 _AUD_PAT = {
@@ -280,11 +450,13 @@ _AUD_PAT = {
     "Teen":   [r"\bteen(s|age|ager|agers)?\b", r"\byouth\b"],
     "Adult":  [r"\badult(s)?\b"]
 }
-_AGE_YEARS_RX = re.compile(r"\b(\d{1,2})\s*(?:\+|plus)?\s*(?:y(?:rs?)?|years?)\b", re.I)
-_AGE_RANGE_YEARS_RX = re.compile(r"\b(\d{1,2})\s*[-–]\s*(\d{1,2})\s*(?:y(?:rs?)?|years?)\b", re.I)
-_AGE_MONTHS_RX = re.compile(r"\b(\d{1,2})\s*(?:m|mos|months?)\b", re.I)
-def _aud_bump(scores: dict, label: str, w: int = 1):
-    scores[label] = scores.get(label, 0) + w
+_AUD_RX = _compile_pats(_AUD_PAT)
+_AGE_YEARS_RX = re.compile(r"\b(\d{1,2})\s*(?:\+|plus)?\s*(?:y(?:rs?)?|years?)\b")
+_AGE_RANGE_YEARS_RX = re.compile(r"\b(\d{1,2})\s*[-–]\s*(\d{1,2})\s*(?:y(?:rs?)?|years?)\b")
+_AGE_MONTHS_RX = re.compile(r"\b(\d{1,2})\s*(?:m|mos|months?)\b")
+_AUD_ORDER = list(_AUD_PAT)  # Infant, Kids, Teen, Adult: ties go to the earlier label
+# any of the three, as one scan: cells without an age phrase (e.g. "60 capsules", "1000 mg") skip the finditer passes
+_AGE_ANY_RX = re.compile("|".join(f"(?:{rx.pattern})" for rx in (_AGE_YEARS_RX, _AGE_RANGE_YEARS_RX, _AGE_MONTHS_RX)))
 def _age_to_bucket(years: int | None = None, months: int | None = None) -> str | None:
     if months is not None:
         if months <= 24: return "Infant"
@@ -296,44 +468,36 @@ def _age_to_bucket(years: int | None = None, months: int | None = None) -> str |
         if 13 <= years <= 17: return "Teen"
         if years >= 18: return "Adult"
     return None
-def infer_targeted_audience(row: pd.Series, ordered_cols: list[str], gender_val: str = "") -> str:
-    scores = {"Adult":0, "Infant":0, "Kids":0, "Teen":0}
-    if str(gender_val).strip() in ("Men","Women"):
-        _aud_bump(scores, "Adult", 2)
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt: 
-            continue
+def _age_buckets(txt: str):
+    for m in _AGE_YEARS_RX.finditer(txt):
+        yield _age_to_bucket(years=int(m.group(1)))
+    for m in _AGE_RANGE_YEARS_RX.finditer(txt):
+        yield _age_to_bucket(years=int(m.group(1)))
+        yield _age_to_bucket(years=int(m.group(2)))
+    for m in _AGE_MONTHS_RX.finditer(txt):
+        yield _age_to_bucket(months=int(m.group(1)))
+def infer_targeted_audience_series(seo_text: dict[str, list[str]], index: pd.Index, gender: pd.Series) -> pd.Series:
+    col = {label: j for j, label in enumerate(_AUD_ORDER)}
+    scores = np.zeros((len(index), len(_AUD_ORDER)), dtype=np.int64)
+    scores[:, col["Adult"]] += 2 * gender.astype(str).str.strip().isin(("Men", "Women")).to_numpy()
+    for c, vals in seo_text.items():
         w = _column_priority_score(c)
-        for label, pats in _AUD_PAT.items():
-            for p in pats:
-                if re.search(p, txt, re.I):
-                    _aud_bump(scores, label, w)
-        for m in _AGE_YEARS_RX.finditer(txt):
-            y = int(m.group(1))
-            bucket = _age_to_bucket(years=y)
-            if bucket: _aud_bump(scores, bucket, w+1)
-        for m in _AGE_RANGE_YEARS_RX.finditer(txt):
-            y1, y2 = int(m.group(1)), int(m.group(2))
-            for y in (y1, y2):
-                bucket = _age_to_bucket(years=y)
-                if bucket: _aud_bump(scores, bucket, w+1)
-        for m in _AGE_MONTHS_RX.finditer(txt):
-            mo = int(m.group(1))
-            bucket = _age_to_bucket(months=mo)
-            if bucket: _aud_bump(scores, bucket, w+1)
-    order = ["Infant","Kids","Teen","Adult"]
-    best = max(order, key=lambda lab: (scores.get(lab,0), -order.index(lab)))
-    if scores.get(best,0) == 0:
-        return "Adult"
-    return best
+        for j, label in enumerate(_AUD_ORDER):
+            scores[:, j] += w * _rx_hits(vals, _AUD_RX[label])
+        # age mentions score w+1 each, even in unweighted columns
+        for i in np.flatnonzero(_rx_mask(vals, _AGE_ANY_RX)).tolist():
+            for bucket in _age_buckets(vals[i]):
+                if bucket: scores[i, col[bucket]] += w + 1
+    best = np.array(_AUD_ORDER, dtype=object)[scores.argmax(axis=1)]
+    best[scores.max(axis=1) == 0] = "Adult"
+    return pd.Series(best, index=index)
 
 # ── Product Form* (single; 'Multiple Forms' if >1 strong) ────────────
 _PRODUCT_FORM_PATTERNS = {
     "Bar":               [r"\b(protein|nutrition)\s+bar\b", r"\bbar\b"],
     "Caplet":            [r"\bcaplet(s)?\b"],
     "Capsule":           [r"\bcapsule(s)?\b", r"\bcaps?\b", r"\bveg(?:etable)?\s*caps?(?:ule)?s?\b"],
-    "Chewable Tablet":   [r"\bchewable\s+tablet(s)?\b", r"\bODT\b", r"\borally\s+disintegrating\s+tablet(s)?\b", r"\bfast[-\s]?dissolv(e|ing)\s+tablet(s)?\b"],
+    "Chewable Tablet":   [r"\bchewable\s+tablet(s)?\b", r"\bodt\b", r"\borally\s+disintegrating\s+tablet(s)?\b", r"\bfast[-\s]?dissolv(e|ing)\s+tablet(s)?\b"],
     "Chewable":          [r"\bchewable\b"],
     "Cream":             [r"\bcream(s)?\b"],
     "Dissolving Strip":  [r"\bdissolving\s+strip(s)?\b", r"\boral\s+strip(s)?\b", r"\bmouth\s+strip(s)?\b"],
@@ -361,46 +525,35 @@ _PF_EXCLUDE = {
     "Gum": [r"\bgummies?\b"],
     "Tea": [r"\btea\s*tree\b"],
 }
-def _match_any(rx_list, text) -> int:
-    if not text: return 0
-    return sum(1 for p in rx_list if re.search(p, text, re.I))
-def _excluded(label: str, text: str) -> bool:
-    for p in _PF_EXCLUDE.get(label, []):
-        if re.search(p, text, re.I):
-            return True
-    return False
-def infer_product_form_from_columns(row: pd.Series, ordered_cols: list[str]) -> str:
-    scores = {k:0 for k in _PRODUCT_FORM_PATTERNS.keys()}
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt:
-            continue
+_PF_EXCLUDE_RX = _compile_pats(_PF_EXCLUDE)
+_PF_LABELS = sorted(_PRODUCT_FORM_PATTERNS)
+@lru_cache(maxsize=None)
+def _product_form_table() -> tuple: return _pattern_table(_PRODUCT_FORM_PATTERNS, _PF_LABELS)
+def infer_product_form_series(seo_text: dict[str, list[str]], index: pd.Index) -> pd.Series:
+    col = {label: j for j, label in enumerate(_PF_LABELS)}
+    scores = np.zeros((len(index), len(_PF_LABELS)), dtype=np.int64)
+    table = _product_form_table()
+    for c, vals in seo_text.items():
         w = _column_priority_score(c)
-        for label, pats in _PRODUCT_FORM_PATTERNS.items():
-            if _excluded(label, txt):
-                continue
-            hits = _match_any(pats, txt)
-            if hits:
-                scores[label] += w * hits
-    if scores["Chewable Tablet"] > 0:
-        scores["Chewable"] = 0
-        scores["Tablet"] = max(0, scores["Tablet"] - 1)
-    if scores["Dissolving Tablet"] > 0:
-        scores["Tablet"] = 0
-    if scores["Softgel"] > 0 or scores["Gelcap"] > 0:
-        scores["Capsule"] = 0
-        scores["Gel"] = max(0, scores["Gel"] - 1)
-    if scores["Gummy"] > 0:
-        scores["Gum"] = 0
-    picks = [(k, v) for k, v in scores.items() if v > 0]
-    if not picks:
-        return ""
-    picks.sort(key=lambda kv: (-kv[1], kv[0]))
-    top_label, top_score = picks[0]
-    other_score = sum(v for _, v in picks[1:])
-    if len(picks) >= 2 and top_score < other_score * 1.5:
-        return "Multiple Forms"
-    return top_label
+        if not w: continue
+        hits = _table_hits(vals, table)
+        for label, (any_rx, _) in _PF_EXCLUDE_RX.items(): hits[:, col[label]] *= ~_rx_mask(vals, any_rx)
+        scores += w * hits
+    S = lambda label: scores[:, col[label]]
+    chew_tab = S("Chewable Tablet") > 0
+    scores[chew_tab, col["Chewable"]] = 0
+    scores[chew_tab, col["Tablet"]] = np.maximum(0, S("Tablet")[chew_tab] - 1)
+    scores[S("Dissolving Tablet") > 0, col["Tablet"]] = 0
+    soft = (S("Softgel") > 0) | (S("Gelcap") > 0)
+    scores[soft, col["Capsule"]] = 0
+    scores[soft, col["Gel"]] = np.maximum(0, S("Gel")[soft] - 1)
+    scores[S("Gummy") > 0, col["Gum"]] = 0
+    # one clear winner, else 'Multiple Forms' when the top score is under 1.5x the rest combined
+    top = scores.max(axis=1); rest = scores.sum(axis=1) - top
+    out = np.array(_PF_LABELS, dtype=object)[scores.argmax(axis=1)]
+    out[((scores > 0).sum(axis=1) >= 2) & (top < rest * 1.5)] = "Multiple Forms"
+    out[top == 0] = ""
+    return pd.Series(out, index=index)
 
 # ── primary flavors (≤3; pipe-delimited) ────────────────────────────
 _FLAVOR_LABELS = [
@@ -446,44 +599,33 @@ _FLAVOR_DEMOTE_IF_CHILD = {
     "No Flavor": ["Unflavored"]
 }
 _FLAVOR_LOW_PRIORITY = {"Flavored","Fresh","Natural","Fruit","Tea","Berry","Milk","Nut","Sugar"}
-def _flavor_hits(label: str, text: str) -> int:
-    pats = _FLAVOR_PAT.get(label, [])
-    return sum(1 for p in pats if re.search(p, text or "", re.I))
-def infer_primary_flavors_from_columns(row: pd.Series, ordered_cols: list[str], max_picks: int = 3) -> str:
-    scores = {lab: 0.0 for lab in _FLAVOR_LABELS}
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt:
-            continue
+@lru_cache(maxsize=None)
+def _flavor_table() -> tuple: return _pattern_table(_FLAVOR_PAT, _FLAVOR_LABELS)
+_FLAVOR_COL = {label: j for j, label in enumerate(_FLAVOR_LABELS)}
+_DEMOTE_MAT = np.zeros((len(_FLAVOR_LABELS), len(_FLAVOR_LABELS)), dtype=np.int8)   # [child, parent]
+for _parent, _children in _FLAVOR_DEMOTE_IF_CHILD.items():
+    _DEMOTE_MAT[[_FLAVOR_COL[ch] for ch in _children], _FLAVOR_COL[_parent]] = 1
+_FLAVOR_BASE_ADJ = np.array([(0.5 if " " in lab else 0.0) - (0.25 if lab in _FLAVOR_LOW_PRIORITY else 0.0) for lab in _FLAVOR_LABELS])
+def infer_primary_flavors_series(seo_text: dict[str, list[str]], index: pd.Index, max_picks: int = 3) -> pd.Series:
+    scores = np.zeros((len(index), len(_FLAVOR_LABELS)), dtype=np.float64)
+    table = _flavor_table()
+    for c, vals in seo_text.items():
         w = float(_column_priority_score(c) or 1)
-        for lab in _FLAVOR_LABELS:
-            hits = _flavor_hits(lab, txt)
-            if hits:
-                base = hits
-                if " " in lab:
-                    base += 0.5
-                if lab in _FLAVOR_LOW_PRIORITY:
-                    base -= 0.25
-                scores[lab] += w * base
-    present = {lab for lab, sc in scores.items() if sc > 0}
-    for parent, children in _FLAVOR_DEMOTE_IF_CHILD.items():
-        if parent in present and any(ch in present for ch in children):
-            scores[parent] *= 0.25
-    picks = [(k, v) for k, v in scores.items() if v >= 1.5]
-    if not picks:
-        if scores.get("Unflavored", 0) > 0:
-            return "Unflavored"
-        return ""
-    picks.sort(key=lambda kv: (-kv[1], kv[0]))
-    selected = [k for k, _ in picks[:max_picks]]
-    if "Unflavored" in selected:
-        selected = [s for s in selected if s not in ("No Flavor","Natural")]
-    return "|".join(selected)
+        hits = _table_hits(vals, table)
+        scores += np.where(hits > 0, w * (hits + _FLAVOR_BASE_ADJ), 0.0)
+    present = scores > 0
+    scores[present & (present.astype(np.int8) @ _DEMOTE_MAT > 0)] *= 0.25   # parent hit alongside any of its children
+    unflavored = (scores[:, _FLAVOR_COL["Unflavored"]] > 0).tolist()
+    out = []
+    for picks, unflav in zip(_top_labels(scores, _FLAVOR_LABELS, max_picks, 1.5), unflavored):
+        if not picks: out.append("Unflavored" if unflav else ""); continue
+        if "Unflavored" in picks: picks = [s for s in picks if s not in ("No Flavor", "Natural")]
+        out.append("|".join(picks))
+    return pd.Series(out, index=index)
 
 # ── Food & Drink Form 1 (single) ─────────────────────────────────────
 _FD_LIQUID_EXCLUDE = re.compile(
-    r"\b(soft[-\s]?gel|gelcap|capsule|tablet|pill|shampoo|conditioner|soap|detergent|cleaner|sanitizer|serum|lotion|toner)\b",
-    re.I
+    r"\b(soft[-\s]?gel|gelcap|capsule|tablet|pill|shampoo|conditioner|soap|detergent|cleaner|sanitizer|serum|lotion|toner)\b"
 )
 _FD_PATTERNS = {
     "Granulated": [r"\bgranulated\b", r"\bgranular\b", r"\bgranule(s)?\b"],
@@ -497,29 +639,22 @@ _FD_PATTERNS = {
     ],
     "Liquid": [r"\bliquid\b", r"\bsyrup\b", r"\bready[-\s]?to[-\s]?drink\b", r"\brtd\b"],
 }
-def _fd_hits(patterns: list[str], text: str) -> int:
-    if not text: return 0
-    return sum(1 for p in patterns if re.search(p, text, re.I))
-def infer_food_and_drink_form1_from_columns(row: pd.Series, ordered_cols: list[str]) -> str:
-    scores = {k: 0.0 for k in _FD_PATTERNS.keys()}
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt:
-            continue
+_FD_RX = _compile_pats(_FD_PATTERNS)
+_FD_LABELS = list(_FD_PATTERNS)  # ties go to the earlier label
+def infer_food_and_drink_form1_series(seo_text: dict[str, list[str]], index: pd.Index) -> pd.Series:
+    scores = np.zeros((len(index), len(_FD_LABELS)), dtype=np.float64)
+    for c, vals in seo_text.items():
         w = float(_column_priority_score(c) or 1)
-        is_non_food_liquid = bool(_FD_LIQUID_EXCLUDE.search(txt))
-        for label, pats in _FD_PATTERNS.items():
-            hits = _fd_hits(pats, txt)
-            if not hits:
-                continue
-            score = w * hits
-            if label == "Liquid" and is_non_food_liquid:
-                score *= 0.1
-            scores[label] += score
-    if scores["Liquid Concentrate"] > 0:
-        scores["Liquid"] *= 0.2
-    best_label, best_score = max(scores.items(), key=lambda kv: kv[1])
-    return best_label if best_score > 0 else ""
+        non_food_liquid = _rx_mask(vals, _FD_LIQUID_EXCLUDE)
+        for j, label in enumerate(_FD_LABELS):
+            score = w * _rx_hits(vals, _FD_RX[label])
+            if label == "Liquid": score = np.where(non_food_liquid, score * 0.1, score)
+            scores[:, j] += score
+    lc = scores[:, _FD_LABELS.index("Liquid Concentrate")] > 0
+    scores[lc, _FD_LABELS.index("Liquid")] *= 0.2
+    out = np.array(_FD_LABELS, dtype=object)[scores.argmax(axis=1)]
+    out[scores.max(axis=1) <= 0] = ""
+    return pd.Series(out, index=index)
 
 # ── Tax* inference (single best match) ───────────────────────────────
 _TAX_LABELS = [
@@ -534,21 +669,17 @@ _TAX_EXCLUDE = {"General"}
 _STOP_TOKENS = {"and","or","with","without","for","the","a","an","of","to","in","on","by","pk","pack","pcs","pc",
                 "oz","ounce","ounces","lb","lbs","g","gram","grams","ml","l","liter","liters","size","screen",
                 "single","dual","us","less","more","than","equal","inch","inches","gal","gallon"}
+_TOKEN_REPL = {"children":"child","babies":"baby","women":"woman","men":"man","webcam":"web camera"}
+@lru_cache(maxsize=8192)
 def _normalize_token(tok: str) -> str:
     t = tok.lower()
     if t.endswith("ies"): t = t[:-3] + "y"
     elif t.endswith("es"): t = t[:-2]
     elif t.endswith("s") and len(t) > 3: t = t[:-1]
-    repl = {"children":"child","babies":"baby","women":"woman","men":"man","webcam":"web camera"}
-    return repl.get(t, t)
-def _tokens(s: str) -> set[str]:
-    raw = re.findall(r"[a-z0-9]+", (s or "").lower())
-    toks = set()
-    for t in raw:
-        n = _normalize_token(t)
-        if n and n not in _STOP_TOKENS:
-            toks.add(n)
-    return toks
+    return _TOKEN_REPL.get(t, t)
+@lru_cache(maxsize=4096)
+def _tokens(s: str) -> frozenset[str]:
+    return frozenset(n for n in map(_normalize_token, _NORM_TOKEN.findall((s or "").lower())) if n and n not in _STOP_TOKENS)
 _TAX_LABEL_TOKENS = {lab: _tokens(lab) for lab in _TAX_LABELS}
 _TAX_SYNONYMS = {
     "Deodorant": [r"\bdeodorant(s)?\b"],
@@ -570,40 +701,49 @@ _TAX_SYNONYMS = {
     "Backpacks & Book Bags": [r"\bback\s*pack(s)?\b|\bbook\s*bag(s)?\b"],
     "Batteries": [r"\b(aa|aaa|c|d|9v)\b.*\bbatter(y|ies)\b|\bbatter(y|ies)\b"],
 }
-def _syn_hits(label: str, text: str) -> int:
-    pats = _TAX_SYNONYMS.get(label, [])
-    return sum(1 for p in pats if re.search(p, text or "", re.I))
-def infer_tax_from_columns(row: pd.Series, ordered_cols: list[str]) -> str:
-    scores = {lab: 0.0 for lab in _TAX_LABELS}
-    for c in ordered_cols:
-        txt = str(row.get(c, "")) or ""
-        if not txt:
-            continue
-        w = float(_column_priority_score(c) or 1)
-        text_tokens = _tokens(txt)
-        text_norm = " " + norm(txt) + " "
-        for lab, lab_tokens in _TAX_LABEL_TOKENS.items():
-            if lab in _TAX_EXCLUDE:
-                continue
-            inter = lab_tokens.intersection(text_tokens)
-            token_score = len(inter)
-            phrase_boost = 0.0
-            if token_score >= 2 and all(t in text_norm for t in lab_tokens):
-                phrase_boost = 1.5
-            syn_boost = 0.75 * _syn_hits(lab, txt)
-            scores[lab] += w * (token_score + phrase_boost + syn_boost)
-    best_label, best_score = "", 0.0
-    for lab, sc in scores.items():
-        if sc > best_score:
-            best_label, best_score = lab, sc
-    if best_score <= 2.0:
-        return ""
-    return best_label
+_TAX_SYNONYMS_RX = _compile_pats(_TAX_SYNONYMS)
+_TAX_TOKEN_ID = {t: k for k, t in enumerate(sorted(set().union(*_TAX_LABEL_TOKENS.values())))}
+# [token, label] 0/1; float32 so the per-chunk matmul goes through BLAS (small integer counts stay exact)
+_TAX_TOKEN_MAT = np.zeros((len(_TAX_TOKEN_ID), len(_TAX_LABEL_TOKENS)), dtype=np.float32)
+for _j, _lab in enumerate(_TAX_LABEL_TOKENS):
+    if _lab in _TAX_EXCLUDE: continue
+    for _t in _TAX_LABEL_TOKENS[_lab]: _TAX_TOKEN_MAT[_TAX_TOKEN_ID[_t], _j] = 1
+_TAX_SYN_COLS = [(j, _TAX_SYNONYMS_RX[lab]) for j, lab in enumerate(_TAX_LABEL_TOKENS)
+                 if lab in _TAX_SYNONYMS_RX and lab not in _TAX_EXCLUDE]
+_TAX_ROW_CHUNK = 2048  # rows scored at a time: keeps the (rows x labels) work arrays bounded for long label lists
+def _tax_cell_scores(vals: list[str]) -> np.ndarray:
+    # a chunk of one column -> (cells x labels): shared label tokens + phrase boost + 0.75 per synonym
+    present = np.zeros((len(vals), len(_TAX_TOKEN_ID)), dtype=np.float32)
+    for i, txt in enumerate(vals):
+        if txt: present[i, [_TAX_TOKEN_ID[t] for t in _tokens(txt) if t in _TAX_TOKEN_ID]] = 1
+    scores = present @ _TAX_TOKEN_MAT
+    del present
+    labels = list(_TAX_LABEL_TOKENS)
+    for i, j in zip(*np.nonzero(scores >= 2)):
+        text_norm = " " + norm(vals[i]) + " "
+        if all(t in text_norm for t in _TAX_LABEL_TOKENS[labels[j]]): scores[i, j] += 1.5
+    for j, pats in _TAX_SYN_COLS: scores[:, j] += 0.75 * _rx_hits(vals, pats)
+    return scores
+def infer_tax_series(seo_text: dict[str, list[str]], index: pd.Index) -> pd.Series:
+    labels = np.array(list(_TAX_LABEL_TOKENS), dtype=object)
+    weights = {c: float(_column_priority_score(c) or 1) for c in seo_text}
+    out = np.empty(len(index), dtype=object)
+    for lo in range(0, len(index), _TAX_ROW_CHUNK):
+        hi = min(lo + _TAX_ROW_CHUNK, len(index))
+        scores = np.zeros((hi - lo, len(labels)), dtype=np.float64)
+        for c, vals in seo_text.items():
+            scores += weights[c] * _tax_cell_scores(vals[lo:hi])
+        # first label with the best score, and only when it clears 2.0
+        best = scores.argmax(axis=1)
+        chunk = labels[best]
+        chunk[scores[np.arange(hi - lo), best] <= 2.0] = ""
+        out[lo:hi] = chunk
+    return pd.Series(out, index=index)
 
 # ── ZIP / XML helpers ────────────────────────────────────────────────
 def _find_sheet_part_path(z: zipfile.ZipFile, sheet_name: str) -> str:
-    wb_xml = ET.fromstring(z.read("xl/workbook.xml"))
-    rels_xml = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+    wb_xml = xml_fromstring(z.read("xl/workbook.xml"))
+    rels_xml = xml_fromstring(z.read("xl/_rels/workbook.xml.rels"))
     rid=None
     for sh in wb_xml.find(f"{{{XL_NS_MAIN}}}sheets"):
         if sh.attrib.get("name")==sheet_name:
@@ -615,25 +755,90 @@ def _find_sheet_part_path(z: zipfile.ZipFile, sheet_name: str) -> str:
             target=rel.attrib.get("Target"); break
     if not target: raise ValueError(f"Relationship for sheet '{sheet_name}' not found.")
     target = target.replace("\\","/")
-    if target.startswith("../"): target=target[3:]
+    if target.startswith("/"): target=target[1:]  # package-absolute target
+    elif target.startswith("../"): target=target[3:]
     if not target.startswith("xl/"): target="xl/"+target
     return target
 
+def _workbook_sheet_names(z: zipfile.ZipFile) -> list[str]:
+    sheets = xml_fromstring(z.read("xl/workbook.xml")).find(f"{{{XL_NS_MAIN}}}sheets")
+    return [sh.attrib.get("name", "") for sh in sheets] if sheets is not None else []
+
+def _xml_rich_text(el) -> str:
+    # <si>/<is>: plain <t> or rich-text runs <r><t>; phonetic <rPh> runs are skipped like openpyxl does
+    if el is None: return None
+    return "".join((t.text or "") for t in el.iterfind(f"{{{XL_NS_MAIN}}}t")) + \
+           "".join((t.text or "") for t in el.iterfind(f"{{{XL_NS_MAIN}}}r/{{{XL_NS_MAIN}}}t"))
+
+def _xml_cell_value(c):
+    # cell value as openpyxl (data_only) reports it, except dates: no number-format lookup, so a date-styled
+    # number stays a float/int serial and t="d" stays its ISO text; shared strings come back as ("s", index)
+    t = c.get("t", "n")
+    if t == "inlineStr": return _xml_rich_text(c.find(f"{{{XL_NS_MAIN}}}is"))
+    v = c.findtext(f"{{{XL_NS_MAIN}}}v")
+    if v is None: return None
+    if t == "s": return ("s", int(v))
+    if t == "b": return bool(int(v))
+    if t in ("str", "e", "d"): return v
+    return float(v) if any(ch in v for ch in ".eE") else int(v)
+
+def _shared_strings(z: zipfile.ZipFile, wanted: set) -> dict[int, str]:
+    # only the <si> entries the header cells point at; stops after the highest one
+    # (part found through the workbook rels, same as the writer's _shared_strings_part)
+    out = {}
+    if not wanted: return out
+    sst_path, sst_exists = _shared_strings_part(z)
+    if not sst_exists: return out
+    last = max(wanted); i = 0
+    with z.open(sst_path) as f:
+        for _, el in xml_iterparse(f):
+            if el.tag != f"{{{XL_NS_MAIN}}}si": continue
+            if i in wanted: out[i] = _xml_rich_text(el)
+            el.clear(); i += 1
+            if i > last: break
+    return out
+
+def _read_headers_from_sheet_xml(z: zipfile.ZipFile, sheet_path: str, rows=(1,)) -> tuple[dict[int, list], int]:
+    # stream the sheet part until past the last wanted row → ({row: values by column}, dimension width or 0)
+    want = set(rows); last = max(rows); found = {}; dim_cols = 0; row_n = 0
+    with z.open(sheet_path) as f:
+        for _, el in xml_iterparse(f):
+            if el.tag == f"{{{XL_NS_MAIN}}}dimension":
+                dim_cols = _col_number((el.get("ref") or "").split(":")[-1])
+            elif el.tag == f"{{{XL_NS_MAIN}}}row":
+                row_n = int(el.get("r") or row_n + 1)
+                if row_n in want:
+                    vals = []
+                    for c in el.iterfind(f"{{{XL_NS_MAIN}}}c"):
+                        ref = c.get("r")
+                        col = _col_number(ref) if ref else len(vals) + 1
+                        vals.extend([None] * (col - len(vals)))
+                        vals[col-1] = _xml_cell_value(c)
+                    found[row_n] = vals
+                el.clear()
+                if row_n >= last: break
+    sst = _shared_strings(z, {v[1] for vals in found.values() for v in vals if isinstance(v, tuple)})
+    for vals in found.values():
+        vals[:] = [sst.get(v[1], "") if isinstance(v, tuple) else v for v in vals]
+    return found, dim_cols
+
 def _get_table_paths_for_sheet(z: zipfile.ZipFile, sheet_path: str) -> list:
     rels_path = sheet_path.replace("worksheets/","worksheets/_rels/").replace(".xml",".xml.rels")
-    if rels_path not in z.namelist(): return []
-    root = ET.fromstring(z.read(rels_path)); out=[]
+    if rels_path not in z.NameToInfo: return []
+    rels = z.read(rels_path)
+    if b"/table" not in rels: return []  # no table relationship anywhere: skip the parse
+    root = xml_fromstring(rels); out=[]
     for rel in root:
         if rel.attrib.get("Type","").endswith("/table"):
             target = rel.attrib.get("Target","").replace("\\","/")
-            if target.startswith("../"): target=target[3:]
+            if target.startswith("/"): target=target[1:]  # package-absolute target
+            elif target.startswith("../"): target=target[3:]
             if not target.startswith("xl/"): target="xl/"+target
             out.append(target)
     return out
 
-def _read_table_cols_count(table_xml_bytes: bytes) -> int:
+def _read_table_cols_count(root) -> int:
     try:
-        root = ET.fromstring(table_xml_bytes)
         tcols = root.find(f"{{{XL_NS_MAIN}}}tableColumns")
         if tcols is None: return 0
         cnt_attr = tcols.attrib.get("count")
@@ -643,10 +848,14 @@ def _read_table_cols_count(table_xml_bytes: bytes) -> int:
     except Exception:
         return 0
 
+_CELL_REF_RX = re.compile(r"([A-Z]+)(\d+)")
+_ROW_RANGE_RX = re.compile(r"^[A-Z]+(\d+):[A-Z]+(\d+)$", re.I)
+_WORKSHEET_TAG_RX = re.compile(rb"<([\w.-]+:)?worksheet\b[^>]*>")
+_SHEETDATA_TAG_RX = re.compile(rb"<([\w.-]+:)?sheetData\b")
 def _union_dimension(orig_dim_ref: str, used_cols: int, last_row: int) -> str:
     try:
         _, right = orig_dim_ref.split(":", 1)
-        m = re.match(r"([A-Z]+)(\d+)", right)
+        m = _CELL_REF_RX.match(right)
         if m:
             orig_last_col=_col_number(m.group(1)); orig_last_row=int(m.group(2))
         else:
@@ -656,56 +865,75 @@ def _union_dimension(orig_dim_ref: str, used_cols: int, last_row: int) -> str:
     u_last_col=max(orig_last_col,used_cols); u_last_row=max(orig_last_row,last_row)
     return f"A1:{_col_letter(u_last_col)}{u_last_row}"
 
+def _row_number(row) -> int:
+    try: return int(row.attrib.get("r") or "0")
+    except Exception: return 0
 def _ensure_ws_x14ac(root):
-    root.set("{http://schemas.openxmlformats.org/markup-compatibility/2006}Ignorable","x14ac")
+    if XML_LXML and root.nsmap.get("x14ac") != XL_NS_X14AC:
+        # lxml can't add a declaration to a parsed element; re-root so x14ac is in scope for mc:Ignorable
+        new_root = ET.Element(root.tag, nsmap={**root.nsmap, "x14ac": XL_NS_X14AC})
+        new_root.attrib.update(root.attrib); new_root.extend(list(root)); root = new_root
+    root.set(f"{{{XL_NS_MC}}}Ignorable","x14ac")
+    return root
 
 def _intersects_range(a1: str, r1: int, r2: int) -> bool:
-    m = re.match(r"^[A-Z]+(\d+):[A-Z]+(\d+)$", a1 or "", re.I)
+    m = _ROW_RANGE_RX.match(a1 or "")
     if not m: return False
     lo=int(m.group(1)); hi=int(m.group(2))
     if lo>hi: lo,hi=hi,lo
     return not (hi<r1 or lo>r2)
 
 # ── Writer (inlineStr only) ──────────────────────────────────────────
-def _patch_sheet_xml(sheet_xml_bytes: bytes, header_row: int, start_row: int, used_cols_final: int, block_2d: list) -> bytes:
-    root = ET.fromstring(sheet_xml_bytes)
-    _ensure_ws_x14ac(root)
+_ROWS_MARKER = "masterfile-data-rows"
+def _xml_text(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
+_ROWS_PER_CHUNK = 2000
+def _rows_xml_chunks(block_cols: dict, n_rows: int, start_row: int, used_cols: int, p: str = "",
+                     fill_cols=frozenset(), fill_s: int | None = None, shared_cols=frozenset()):
+    # block_cols: {0-based column: values for every row}; only mapped columns are present.
+    # values arrive already sanitized and stripped (Step 5), so empties are the only thing to skip,
+    # except in fill_cols, where an empty cell is still written carrying style fill_s.
+    # shared_cols: columns whose values are shared-string indices (as text) rather than the strings
+    row_span = f"1:{used_cols}" if used_cols > 0 else "1:1"
+    if fill_s is None: fill_cols = frozenset()
+    cols = sorted(j for j in set(block_cols) | set(fill_cols) if j < used_cols)
+    letters = [_col_letter(j + 1) for j in cols]
+    empty = f' s="{fill_s}"/>'
+    blanks = [empty if j in fill_cols else None for j in cols]
+    shared = [j in shared_cols for j in cols]
+    col_rows = zip(*(block_cols.get(j, ("",) * n_rows) for j in cols)) if cols else ((),) * n_rows
+    out = []
+    for r, src_row in enumerate(col_rows, start=start_row):
+        out.append(f'<{p}row r="{r}" spans="{row_span}" x14ac:dyDescent="0.25">')
+        for col, val, blank, sh in zip(letters, src_row, blanks, shared):
+            if not val:
+                if blank: out.append(f'<{p}c r="{col}{r}"{blank}')
+                continue
+            if sh: out.append(f'<{p}c r="{col}{r}" t="s"><{p}v>{val}</{p}v></{p}c>')
+            else: out.append(f'<{p}c r="{col}{r}" t="inlineStr"><{p}is><{p}t xml:space="preserve">{_xml_text(val)}</{p}t></{p}is></{p}c>')
+        out.append(f"</{p}row>")
+        if (r - start_row + 1) % _ROWS_PER_CHUNK == 0:
+            yield "".join(out).encode("utf-8"); out = []
+    if out: yield "".join(out).encode("utf-8")
+def _patch_sheet_xml(sheet_xml_bytes: bytes, header_row: int, start_row: int, used_cols_final: int, block_cols: dict, n_rows: int,
+                     fill_cols=frozenset(), fill_s: int | None = None, shared_cols=frozenset()):
+    root = xml_fromstring(sheet_xml_bytes)
     sheetData = root.find(f"{{{XL_NS_MAIN}}}sheetData")
     if sheetData is None:
         sheetData = ET.SubElement(root, f"{{{XL_NS_MAIN}}}sheetData")
-    for row in list(sheetData):
-        try: r = int(row.attrib.get("r") or "0")
-        except Exception: r = 0
-        if r >= start_row:
-            sheetData.remove(row)
+    keep = [row for row in sheetData if _row_number(row) < start_row]
+    if len(keep) != len(sheetData): sheetData[:] = keep
     mergeCells = root.find(f"{{{XL_NS_MAIN}}}mergeCells")
     if mergeCells is not None:
-        for mc in list(mergeCells):
-            if _intersects_range(mc.attrib.get("ref",""), start_row, 1048576):
-                mergeCells.remove(mc)
-        if len(list(mergeCells)) == 0:
+        # one rebuild instead of a remove() per dropped merge (each remove rescans the children)
+        keep = [mc for mc in mergeCells if not _intersects_range(mc.attrib.get("ref",""), start_row, 1048576)]
+        if len(keep) != len(mergeCells): mergeCells[:] = keep
+        if len(keep) == 0:
             root.remove(mergeCells)
-    row_span = f"1:{used_cols_final}" if used_cols_final > 0 else "1:1"
-    n_rows = len(block_2d)
-    for i in range(n_rows):
-        r = start_row + i
-        src_row = block_2d[i]
-        row_el = ET.Element(f"{{{XL_NS_MAIN}}}row", r=str(r))
-        row_el.set("spans", row_span)
-        row_el.set("{http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac}dyDescent", "0.25")
-        for j in range(used_cols_final):
-            val = src_row[j] if j < len(src_row) else ""
-            txt = sanitize_xml_text(val).strip() if val else ""
-            if not txt:
-                continue
-            col = _col_letter(j + 1)
-            c = ET.Element(f"{{{XL_NS_MAIN}}}c", r=f"{col}{r}", t="inlineStr")
-            is_el = ET.SubElement(c, f"{{{XL_NS_MAIN}}}is")
-            t_el = ET.SubElement(is_el, f"{{{XL_NS_MAIN}}}t")
-            t_el.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
-            t_el.text = txt
-            row_el.append(c)
-        sheetData.append(row_el)
+    # lxml re-roots to declare x14ac, moving every child: cheap only once the old data rows are gone
+    root = _ensure_ws_x14ac(root)
+    # new rows are emitted as text and spliced in after serialization (no per-cell elements)
+    sheetData.append(ET.Comment(_ROWS_MARKER))
     dim = root.find(f"{{{XL_NS_MAIN}}}dimension")
     if dim is None:
         dim = ET.SubElement(root, f"{{{XL_NS_MAIN}}}dimension", ref="A1:A1")
@@ -717,56 +945,197 @@ def _patch_sheet_xml(sheet_xml_bytes: bytes, header_row: int, start_row: int, us
     sheetPr = root.find(f"{{{XL_NS_MAIN}}}sheetPr")
     if sheetPr is not None and sheetPr.attrib.get("filterMode"):
         sheetPr.attrib.pop("filterMode", None)
-    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    out = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    root_tag = _WORKSHEET_TAG_RX.search(out)
+    if b"xmlns:x14ac=" not in root_tag.group(0):  # stdlib only declares prefixes it used
+        out = out[:root_tag.end()-1] + f' xmlns:x14ac="{XL_NS_X14AC}"'.encode() + out[root_tag.end()-1:]
+    prefix = (_SHEETDATA_TAG_RX.search(out).group(1) or b"").decode()
+    head, tail = out.split(f"<!--{_ROWS_MARKER}-->".encode(), 1)
+    # the part comes back in pieces (rows encoded a chunk at a time) so it can be streamed into the zip
+    rows = _rows_xml_chunks(block_cols, n_rows, start_row, used_cols_final, prefix, fill_cols, fill_s, shared_cols)
+    return itertools.chain((head,), rows, (tail,))
 
-def _patch_table_xml(table_xml_bytes: bytes, header_row: int, last_row: int, last_col_n: int) -> bytes:
-    root = ET.fromstring(table_xml_bytes)
+def _patch_table_xml(root, header_row: int, last_row: int, last_col_n: int) -> bytes:
     new_ref = f"A{header_row}:{_col_letter(last_col_n)}{last_row}"
     root.set("ref", new_ref)
-    af = root.find(f"{{{XL_NS_MAIN}}}autoFilter") or ET.SubElement(root, f"{{{XL_NS_MAIN}}}autoFilter")
+    af = root.find(f"{{{XL_NS_MAIN}}}autoFilter")
+    if af is None: af = ET.SubElement(root, f"{{{XL_NS_MAIN}}}autoFilter")
     af.set("ref", new_ref)
     tcols = root.find(f"{{{XL_NS_MAIN}}}tableColumns")
     if tcols is not None:
         tcols.set("count", str(sum(1 for _ in tcols)))
     return ET.tostring(root, encoding="utf-8", xml_declaration=True)
 
+_HIGHLIGHT_RGB = "00FFFF00"  # yellow
+_COUNT_ATTR_RX = re.compile(rb'(\scount=")\d*(")')
+def _set_count(open_tag: bytes, n: int) -> bytes:
+    if _COUNT_ATTR_RX.search(open_tag): return _COUNT_ATTR_RX.sub(rb"\g<1>%d\g<2>" % n, open_tag, count=1)
+    return open_tag[:-1] + b' count="%d">' % n
+def _add_fill_xf(styles_xml: bytes, rgb: str) -> tuple[bytes, int | None]:
+    # append a solid fill and a cellXfs entry using it → (new styles.xml, xf index); spliced as text so
+    # the part keeps its own namespace declarations (mc:Ignorable prefixes included)
+    fills = re.search(rb"<((?:[\w.-]+:)?)fills\b[^>]*>(.*?)</(?:[\w.-]+:)?fills>", styles_xml, re.S)
+    xfs = re.search(rb"<((?:[\w.-]+:)?)cellXfs\b[^>]*>(.*?)</(?:[\w.-]+:)?cellXfs>", styles_xml, re.S)
+    if not fills or not xfs or xfs.start() < fills.end(): return styles_xml, None
+    p = fills.group(1).decode()
+    fill_id = len(re.findall(rb"<(?:[\w.-]+:)?fill\b", fills.group(2)))
+    xf_id = len(re.findall(rb"<(?:[\w.-]+:)?xf\b", xfs.group(2)))
+    fill = f'<{p}fill><{p}patternFill patternType="solid"><{p}fgColor rgb="{rgb}"/><{p}bgColor indexed="64"/></{p}patternFill></{p}fill>'
+    xf = f'<{p}xf numFmtId="0" fontId="0" fillId="{fill_id}" borderId="0" xfId="0" applyFill="1"/>'
+    def splice(b: bytes, m, new: str, n: int) -> bytes:
+        open_end = m.start(2); close_start = m.end(2)
+        open_tag = _set_count(b[m.start():open_end], n)
+        return b[:m.start()] + open_tag + b[open_end:close_start] + new.encode() + b[close_start:]
+    out = splice(styles_xml, xfs, xf, xf_id + 1)  # later part first so the fills offsets stay valid
+    return splice(out, fills, fill, fill_id + 1), xf_id
+
+# ── Shared strings (data cells reference one pooled copy of each distinct value) ──
+_SST_REL_TYPE = f"{XL_NS_REL}/sharedStrings"
+_SST_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+_SST_OPEN_RX = re.compile(rb"<((?:[\w.-]+:)?)sst\b[^>]*?(/?)>")
+_SST_SI_RX = re.compile(rb"<(?:[\w.-]+:)?si\b")
+_SST_COUNTS_RX = re.compile(rb'(\s(count|uniqueCount)=")(\d*)(")')
+_REL_ID_RX = re.compile(rb'\bId="rId(\d+)"')
+def _shared_strings_part(z: zipfile.ZipFile) -> tuple[str | None, bool]:
+    # (path of the workbook's shared-strings part, whether it exists yet); None → leave cells inline
+    try: rels = xml_fromstring(z.read("xl/_rels/workbook.xml.rels"))
+    except Exception: return None, False
+    for rel in rels:
+        if rel.attrib.get("Type") == _SST_REL_TYPE:
+            target = rel.attrib.get("Target","").replace("\\","/")
+            # package-absolute, else relative to xl/ (normpath folds any ../ segments)
+            target = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+            return (target, True) if target in z.NameToInfo else (None, False)
+    return (None, False) if "xl/sharedStrings.xml" in z.NameToInfo else ("xl/sharedStrings.xml", False)
+_SST_MAX_DISTINCT = 0.5  # pool a column only when at most this share of its sampled cells are distinct
+_SST_SAMPLE = 2000
+def _shared_string_cols(block_cols: dict, base: int) -> tuple[dict, list[str], int]:
+    # repetitive columns (brand, category, flags...) → values replaced by their index (as text, numbered from
+    # base) among the pooled distinct non-empty values, first-seen order; mostly-unique text stays inline
+    # → (index columns, the new strings, how many cells reference them)
+    cols = [j for j, vals in block_cols.items()
+            if vals and len(set(vals[:_SST_SAMPLE])) <= _SST_MAX_DISTINCT * min(len(vals), _SST_SAMPLE)]
+    if not cols: return {}, [], 0
+    n = len(block_cols[cols[0]])
+    codes, uniques = pd.factorize(np.concatenate([np.asarray(block_cols[j], dtype=object) for j in cols]))
+    used = uniques != ""
+    ids = np.where(used, np.cumsum(used) - 1 + base, -1).astype(str).astype(object)
+    ids[~used] = ""
+    flat = ids[codes]
+    return {j: flat[k*n:(k+1)*n].tolist() for k, j in enumerate(cols)}, uniques[used].tolist(), int(used[codes].sum())
+def _append_shared_strings(sst_xml: bytes | None, base: int, strings: list[str], n_refs: int) -> bytes:
+    # new <si> entries spliced in before </sst> (text splice, like the styles patch); a fresh part when there was none
+    if sst_xml is None:
+        sst_xml = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns="{XL_NS_MAIN}" count="0" uniqueCount="0"/>'.encode()
+    m = _SST_OPEN_RX.search(sst_xml)
+    p = m.group(1).decode()
+    def bump(a):  # count = cell references, uniqueCount = entries
+        n = base + len(strings) if a.group(2) == b"uniqueCount" else int(a.group(3) or 0) + n_refs
+        return a.group(1) + str(n).encode() + a.group(4)
+    open_tag = _SST_COUNTS_RX.sub(bump, m.group(0))
+    items = "".join(f'<{p}si><{p}t xml:space="preserve">{_xml_text(s)}</{p}t></{p}si>' for s in strings).encode("utf-8")
+    if m.group(2):  # <sst .../> → open, entries, close
+        return sst_xml[:m.start()] + open_tag[:-2] + b">" + items + f"</{p}sst>".encode() + sst_xml[m.end():]
+    close = sst_xml.rindex(f"</{p}sst>".encode())
+    return sst_xml[:m.start()] + open_tag + sst_xml[m.end():close] + items + sst_xml[close:]
+def _insert_before_close(xml: bytes, tag: str, new: str) -> bytes:
+    # one self-closing child (new, written unprefixed) just before the root's closing tag, in the root's prefix
+    m = re.search(rb"</((?:[\w.-]+:)?)" + tag.encode() + rb"\s*>\s*$", xml)
+    if m is None: raise ValueError(f"no closing </{tag}> at the end of the part")
+    return xml[:m.start()] + (f"<{m.group(1).decode()}" + new[1:]).encode() + xml[m.start():]
+def _add_shared_strings_rel(rels_xml: bytes) -> bytes:
+    rid = 1 + max((int(n) for n in _REL_ID_RX.findall(rels_xml)), default=0)
+    return _insert_before_close(rels_xml, "Relationships",
+                                f'<Relationship Id="rId{rid}" Type="{_SST_REL_TYPE}" Target="sharedStrings.xml"/>')
+def _add_shared_strings_override(ct_xml: bytes, part: str) -> bytes:
+    # a second Override for the same PartName makes Excel refuse the file
+    if re.search(rb"\bPartName=([\"'])/" + re.escape(part.encode()) + rb"\1", ct_xml, re.I): return ct_xml
+    return _insert_before_close(ct_xml, "Types", f'<Override PartName="/{part}" ContentType="{_SST_CONTENT_TYPE}"/>')
+
+_CALCCHAIN_OVERRIDE_RX = re.compile(
+    rb"<(?:[\w.-]+:)?Override\b[^>]*\bPartName=([\"'])/xl/calcchain\.xml\1[^>]*?(?:/>|>\s*</(?:[\w.-]+:)?Override>)", re.I)
 def _strip_calcchain_override(ct_bytes: bytes) -> bytes:
-    try:
-        ns="http://schemas.openxmlformats.org/package/2006/content-types"
-        root=ET.fromstring(ct_bytes); ET.register_namespace("", ns)
-        for el in list(root):
-            if el.tag==f"{{{ns}}}Override" and el.attrib.get("PartName","").lower()=="/xl/calcchain.xml":
-                root.remove(el)
-        return ET.tostring(root, encoding="utf-8", xml_declaration=True)
-    except Exception:
-        return ct_bytes
+    # one element out of [Content_Types].xml: cut from the bytes, no parse/serialize of the part
+    return _CALCCHAIN_OVERRIDE_RX.sub(b"", ct_bytes)
+
+_ZIP_LEVEL = 1  # deflate level for rewritten parts: ~2.7x faster than the default 6 on sheet XML, ~25% larger
+def _zip_write_chunks(zout: zipfile.ZipFile, info: zipfile.ZipInfo, chunks) -> None:
+    # stream a part into the archive piece by piece; the whole sheet XML is never held as one buffer
+    info._compresslevel = _ZIP_LEVEL  # what writestr(compresslevel=) sets; open() takes no level
+    with zout.open(info, "w") as dst:
+        for chunk in chunks: dst.write(chunk)
+def _zip_copy_raw(src: bytes, info: zipfile.ZipInfo, zout: zipfile.ZipFile) -> bool:
+    # pass an untouched part through still compressed (no inflate/deflate round trip); False → caller rewrites it
+    if info.flag_bits & 0x1 or max(info.file_size, info.compress_size) >= zipfile.ZIP64_LIMIT: return False
+    off = info.header_offset
+    if src[off:off+4] != b"PK\x03\x04": return False
+    name_len, extra_len = struct.unpack("<HH", src[off+26:off+30])
+    start = off + 30 + name_len + extra_len
+    zi = copy.copy(info); zi.flag_bits &= ~0x08  # sizes/CRC go in the local header, no data descriptor
+    zi.header_offset = zout.fp.tell()
+    zout.fp.write(zi.FileHeader(False)); zout.fp.write(memoryview(src)[start:start + info.compress_size])
+    zout.filelist.append(zi); zout.NameToInfo[zi.filename] = zi
+    zout.start_dir = zout.fp.tell()
+    return True
 
-def fast_patch_template(master_bytes: bytes, sheet_name: str, header_row: int, start_row: int, used_cols: int, block_2d: list) -> bytes:
+def fast_patch_template(master_bytes: bytes, sheet_name: str, header_row: int, start_row: int, used_cols: int, block_cols: dict, n_rows: int,
+                        highlight_cols=frozenset()) -> tuple[bytes, bool]:
+    # highlight_cols: 0-based columns whose empty data cells get a yellow fill
+    # returns (xlsx bytes, whether the fill was applied — False when styles.xml is missing or has no <fills>/<cellXfs>)
     zin = zipfile.ZipFile(io.BytesIO(master_bytes), "r")
     sheet_path = _find_sheet_part_path(zin, sheet_name)
+    styles_path = next((n for n in zin.namelist() if n.lower() == "xl/styles.xml"), None)
+    new_styles_xml, fill_s = None, None
+    if highlight_cols and styles_path:
+        new_styles_xml, fill_s = _add_fill_xf(zin.read(styles_path), _HIGHLIGHT_RGB)
     table_paths = _get_table_paths_for_sheet(zin, sheet_path)
-    max_cols = used_cols
+    table_roots = {}  # each table part is inflated and parsed once, for both the width probe and the patch
     for tp in table_paths:
-        try:
-            cnt=_read_table_cols_count(zin.read(tp))
-            if cnt>max_cols: max_cols=cnt
+        try: table_roots[tp] = xml_fromstring(zin.read(tp))
         except: pass
-    new_sheet_xml = _patch_sheet_xml(zin.read(sheet_path), header_row, start_row, max_cols, block_2d)
-    last_row = max(header_row, start_row + max(0, len(block_2d)) - 1)
+    max_cols = max([used_cols, *(_read_table_cols_count(root) for root in table_roots.values())])
+    # repetitive columns go in as shared strings (each distinct value escaped and stored once); the rest stay inline
+    sst_path, sst_exists = _shared_strings_part(zin)
+    new_sst_xml, shared_cols = None, frozenset()
+    ct_path = next((n for n in zin.namelist() if n.lower() == "[content_types].xml"), None)
+    new_rels_xml = new_ct_xml = None
+    if sst_path:
+        try:
+            sst_xml = zin.read(sst_path) if sst_exists else None
+            base = len(_SST_SI_RX.findall(sst_xml)) if sst_xml else 0
+            pooled, strings, n_refs = _shared_string_cols(block_cols, base)
+            if pooled:
+                new_sst_xml = _append_shared_strings(sst_xml, base, strings, n_refs)
+                if not sst_exists:  # a new part needs its rel and content type; spliced here so a failure falls back too
+                    new_rels_xml = _add_shared_strings_rel(zin.read("xl/_rels/workbook.xml.rels"))
+                    new_ct_xml = _add_shared_strings_override(_strip_calcchain_override(zin.read(ct_path)), sst_path)
+                block_cols = {**block_cols, **pooled}; shared_cols = frozenset(pooled)
+        except Exception:
+            new_sst_xml = new_rels_xml = new_ct_xml = None
+        if new_sst_xml is None: sst_path = None  # nothing pooled or a splice failed: cells stay inline, parts untouched
+    sheet_chunks = _patch_sheet_xml(zin.read(sheet_path), header_row, start_row, max_cols, block_cols, n_rows,
+                                    highlight_cols, fill_s, shared_cols)
+    last_row = max(header_row, start_row + max(0, n_rows) - 1)
     patched_tables={}
-    for tp in table_paths:
-        try: patched_tables[tp]=_patch_table_xml(zin.read(tp), header_row, last_row, max_cols)
+    for tp, root in table_roots.items():
+        try: patched_tables[tp]=_patch_table_xml(root, header_row, last_row, max_cols)
         except: pass
     out_bio = io.BytesIO()
     with zipfile.ZipFile(out_bio, "w", zipfile.ZIP_DEFLATED) as zout:
+        # ZipInfo entries ignore the ZipFile's compresslevel, so the level goes on each rewrite
+        put = lambda item, data: zout.writestr(item, data, compresslevel=_ZIP_LEVEL)
         for item in zin.infolist():
             fn=item.filename
-            if fn==sheet_path: zout.writestr(item, new_sheet_xml)
-            elif fn in patched_tables: zout.writestr(item, patched_tables[fn])
-            elif fn.lower()=="[content_types].xml": zout.writestr(item, _strip_calcchain_override(zin.read(fn)))
+            if fn==sheet_path: _zip_write_chunks(zout, item, sheet_chunks)
+            elif fn in patched_tables: put(item, patched_tables[fn])
+            elif fn == styles_path and fill_s is not None: put(item, new_styles_xml)
+            elif fn == sst_path: put(item, new_sst_xml)
+            elif fn == ct_path: put(item, new_ct_xml if new_ct_xml is not None else _strip_calcchain_override(zin.read(fn)))
+            elif fn == "xl/_rels/workbook.xml.rels" and new_rels_xml is not None: put(item, new_rels_xml)
             elif fn.lower()=="xl/calcchain.xml": continue
-            else: zout.writestr(item, zin.read(fn))
-    zin.close(); out_bio.seek(0); return out_bio.getvalue()
+            elif not _zip_copy_raw(master_bytes, item, zout): put(item, zin.read(fn))
+        if sst_path and not sst_exists: zout.writestr(sst_path, new_sst_xml, compresslevel=_ZIP_LEVEL)
+    zin.close(); out_bio.seek(0); return out_bio.getvalue(), fill_s is not None
 
 # ── UI ───────────────────────────────────────────────────────────────
 st.title("🎯 Masterfile Automation – Target")
@@ -789,9 +1158,9 @@ with c2:
 st.markdown("#### 🔎 Row filter (by category)")
 if onboarding_file is not None:
     try:
-        xl = pd.ExcelFile(onboarding_file)
-        preview = xl.parse(xl.sheet_names[0], header=0, dtype=str, nrows=200).fillna("")
-        preview.columns = [str(c).strip() for c in preview.columns]
+        onboarding_bytes = onboarding_file.getvalue()
+        # the workbook's first sheet itself; if it can't be read, say so rather than previewing another sheet
+        preview = _load_onboarding_sheet(onboarding_bytes, 0, 200)
         if len(preview.columns) > 0:
             first_col = preview.columns[0]
             st.caption(f"Using onboarding column **{first_col}**")
@@ -852,8 +1221,8 @@ if go:
         # Step 1: mapping JSON
         slog("⏳ **Step 1/6:** Parsing mapping JSON...", 0.1)
         try:
-            if mapping_json_text.strip(): mapping_raw = json.loads(mapping_json_text)
-            elif mapping_json_file: mapping_raw = json.load(mapping_json_file)
+            if mapping_json_text.strip(): mapping_raw = json_loads(mapping_json_text)
+            elif mapping_json_file: mapping_raw = json_loads(mapping_json_file.read())
             else: st.error("❌ Please provide mapping JSON (paste or upload)."); st.markdown("</div>", unsafe_allow_html=True); st.stop()
         except json.JSONDecodeError as e:
             st.error(f"❌ Invalid JSON format: {e}"); st.markdown("</div>", unsafe_allow_html=True); st.stop()
@@ -864,33 +1233,33 @@ if go:
             aliases = v[:] if isinstance(v, list) else [v]
             if k not in aliases: aliases.append(k)
             mapping_aliases[norm(k)] = aliases
+        mapping_aliases_norm = {k: tuple(norm(a) for a in v) for k, v in mapping_aliases.items()}
         slog(f"✅ Loaded {len(mapping_aliases)} header mappings", 0.2)
 
         # Step 2: template headers
         slog("⏳ **Step 2/6:** Reading template headers...", 0.3)
         masterfile_file.seek(0); master_bytes = masterfile_file.read()
-        wb_ro = load_workbook(io.BytesIO(master_bytes), read_only=True, data_only=True, keep_links=True)
-        if MASTER_TEMPLATE_SHEET not in wb_ro.sheetnames:
-            st.error(f"❌ Sheet **'{MASTER_TEMPLATE_SHEET}'** not found. Available: {', '.join(wb_ro.sheetnames)}"); st.markdown("</div>", unsafe_allow_html=True); st.stop()
-        ws_ro = wb_ro[MASTER_TEMPLATE_SHEET]
-        used_cols = worksheet_used_cols(ws_ro, header_rows=(MASTER_DISPLAY_ROW, MASTER_SECONDARY_ROW))
-        display_headers   = [ws_ro.cell(row=MASTER_DISPLAY_ROW,   column=c).value or "" for c in range(1, used_cols+1)]
-        secondary_headers = [ws_ro.cell(row=MASTER_SECONDARY_ROW, column=c).value or "" for c in range(1, used_cols+1)]
-        wb_ro.close()
+        sheetnames, used_cols, display_headers, secondary_headers = _template_headers(master_bytes)
+        if MASTER_TEMPLATE_SHEET not in sheetnames:
+            st.error(f"❌ Sheet **'{MASTER_TEMPLATE_SHEET}'** not found. Available: {', '.join(sheetnames)}"); st.markdown("</div>", unsafe_allow_html=True); st.stop()
         slog(f"✅ Loaded {used_cols} template columns", 0.4)
 
         # Step 3: read onboarding (best sheet)
         slog("⏳ **Step 3/6:** Analyzing onboarding sheet...", 0.5)
-        best_xl = pd.ExcelFile(onboarding_file)
+        # score header rows only; full-parse sheets best-first and stop once nothing left can win
+        onboarding_bytes = onboarding_file.getvalue()
+        sheet_matches = []
+        for sheet, headers in _onboarding_headers(onboarding_bytes).items():
+            header_set = {norm(c) for c in headers}
+            sheet_matches.append((sum(any(a in header_set for a in aliases) for aliases in mapping_aliases_norm.values()), sheet))
+        sheet_matches.sort(key=lambda t: -t[0])
         best, best_score, best_info = None, -1, ""
-        for sheet in best_xl.sheet_names:
+        for matches, sheet in sheet_matches:
+            if matches + 0.01 <= best_score: break
             try:
-                df = best_xl.parse(sheet_name=sheet, header=0, dtype=str).fillna("")
-                df.columns = [str(c).strip() for c in df.columns]
+                df = _load_onboarding_sheet(onboarding_bytes, sheet)
             except Exception:
                 continue
-            header_set = {norm(c) for c in df.columns}
-            matches = sum(any(norm(a) in header_set for a in aliases) for aliases in mapping_aliases.values())
             rows = nonempty_rows(df); score = matches + (0.01 if rows>0 else 0.0)
             if score > best_score:
                 best, best_score = (df, sheet), score
@@ -918,17 +1287,18 @@ if go:
         try:
             seo_cols = select_seo_columns(on_df)
             ordered = order_seo_columns(seo_cols)
+            seo_text = seo_column_text(on_df, ordered)
 
-            on_df["Gender"] = on_df.apply(lambda r: infer_gender_from_columns(r, ordered), axis=1)
-            on_df["health and beauty subtype*"] = on_df.apply(lambda r: infer_hb_subtype_from_columns(r, ordered), axis=1)
-            on_df["Health Application*"] = on_df.apply(lambda r: infer_health_app_from_columns(r, ordered), axis=1)
-            on_df["Targeted Audience*"] = on_df.apply(lambda r: infer_targeted_audience(r, ordered, r.get("Gender","")), axis=1)
+            on_df["Gender"] = infer_gender_series(seo_text, on_df.index)
+            on_df["health and beauty subtype*"] = infer_hb_subtype_series(seo_text, on_df.index)
+            on_df["Health Application*"] = infer_health_app_series(seo_text, on_df.index)
+            on_df["Targeted Audience*"] = infer_targeted_audience_series(seo_text, on_df.index, on_df["Gender"])
             on_df["Legally Required Information*"] = "Healthcare Disclaimer"
-            on_df["Product Form*"] = on_df.apply(lambda r: infer_product_form_from_columns(r, ordered), axis=1)
-            on_df["primary flavors"] = on_df.apply(lambda r: infer_primary_flavors_from_columns(r, ordered, 3), axis=1)
-            on_df["food and drink form 1"] = on_df.apply(lambda r: infer_food_and_drink_form1_from_columns(r, ordered), axis=1)
+            on_df["Product Form*"] = infer_product_form_series(seo_text, on_df.index)
+            on_df["primary flavors"] = infer_primary_flavors_series(seo_text, on_df.index, 3)
+            on_df["food and drink form 1"] = infer_food_and_drink_form1_series(seo_text, on_df.index)
             on_df["Prop 65"] = "No"
-            on_df["Tax*"] = on_df.apply(lambda r: infer_tax_from_columns(r, ordered), axis=1)
+            on_df["Tax*"] = infer_tax_series(seo_text, on_df.index)
 
         except Exception:
             on_df["Gender"] = "Gender Neutral"
@@ -964,6 +1334,7 @@ if go:
         series_by_alias = {norm(h): on_df[h] for h in on_headers}
         report_lines = ["#### 🔎 Column Mapping Results"]
         master_to_source = {}; matched_count=0; unmatched_count=0
+        unmatched = []  # (report line index, header) — suggestions are scored in one batch below
         helper_cols_idx = set()  # 1-based indices in the template for highlighting
 
         for c, (disp, sec) in enumerate(zip(display_headers, secondary_headers), start=1):
@@ -976,61 +1347,43 @@ if go:
 
             aliases = mapping_aliases.get(eff_norm, [eff])
             resolved=None; matched_alias=None
-            for a in aliases:
-                s = series_by_alias.get(norm(a))
+            for a, a_norm in zip(aliases, mapping_aliases_norm.get(eff_norm, (eff_norm,))):
+                s = series_by_alias.get(a_norm)
                 if s is not None: resolved=s; matched_alias=a; break
             if resolved is not None:
                 master_to_source[c]=resolved; matched_count+=1
                 report_lines.append(f"- ✅ **{eff}** ← `{matched_alias}`")
             else:
-                sugg = top_matches(eff, on_headers, 3)
-                sug_txt = ", ".join(f"`{name}` ({round(sc*100,1)}%)" for sc,name in sugg) if sugg else "*none*"
-                report_lines.append(f"- ❌ **{eff}** ← _no match_. Suggestions: {sug_txt}"); unmatched_count+=1
+                unmatched.append((len(report_lines), eff)); report_lines.append(""); unmatched_count+=1
 
+        for (li, eff), sugg in zip(unmatched, top_matches_cached(tuple(eff for _, eff in unmatched), tuple(on_headers), 3)):
+            sug_txt = ", ".join(f"`{name}` ({round(sc*100,1)}%)" for sc,name in sugg) if sugg else "*none*"
+            report_lines[li] = f"- ❌ **{eff}** ← _no match_. Suggestions: {sug_txt}"
         st.markdown("\n".join(report_lines))
         st.info(f"📊 Mapping Stats: **{matched_count} matched**, **{unmatched_count} unmatched** out of {len(display_headers)} total columns")
 
         # Step 5: build data block
         slog("⏳ **Step 5/6:** Building data block...", 0.7)
         n_rows = len(on_df)
-        block = [[""] * used_cols for _ in range(n_rows)]
+        block_cols = {}  # 0-based template column -> cleaned values; unmapped columns stay absent
         for col, src in master_to_source.items():
-            vals = src.astype(str).tolist(); m=min(len(vals), n_rows)
-            for i in range(m):
-                v = sanitize_xml_text(vals[i].strip())
-                if v and v.lower() not in ("nan","none",""):
-                    block[i][col-1] = v
+            v = src.astype(str).str.replace(_INVALID_XML_CHARS, "", regex=True).str.strip().tolist()
+            # literal nan/none (any case) → empty; the length test skips lower() for almost every cell
+            block_cols[col - 1] = ["" if len(x) <= 4 and x.lower() in ("nan", "none") else x for x in v]
         slog(f"✅ Built data block: {n_rows} rows × {used_cols} columns", 0.8)
 
-        # Step 6: write file (fast XML)
+        # Step 6: write file (fast XML); empty helper attrs (within used_cols) are written with a yellow fill
         slog("⏳ **Step 6/6:** Writing final masterfile via fast XML...", 0.85)
-        out_bytes = fast_patch_template(master_bytes=master_bytes, sheet_name=MASTER_TEMPLATE_SHEET,
-                                        header_row=MASTER_DISPLAY_ROW, start_row=MASTER_DATA_START_ROW,
-                                        used_cols=used_cols, block_2d=block)
-
-        # Step 6b: post-highlight empty helper attrs in yellow
-        slog("🎨 Applying yellow highlight to empty helper attributes…", 0.92)
-        wb = load_workbook(io.BytesIO(out_bytes), keep_vba=(ext == ".xlsm"))
-        ws = wb[MASTER_TEMPLATE_SHEET]
-        yellow = PatternFill(fill_type="solid", fgColor="FFFF00")
-
-        # for each data row, if helper column value empty, fill yellow
-        for i in range(n_rows):
-            excel_row = MASTER_DATA_START_ROW + i
-            # safety: only highlight existing helper columns within used_cols
-            for col_idx in helper_cols_idx:
-                if col_idx < 1 or col_idx > used_cols:
-                    continue
-                val = block[i][col_idx - 1] if i < len(block) and (col_idx - 1) < len(block[i]) else ""
-                if str(val).strip() == "":
-                    ws.cell(row=excel_row, column=col_idx).fill = yellow
-
-        out_bio2 = io.BytesIO()
-        wb.save(out_bio2)
-        out_bio2.seek(0)
-        out_bytes_final = out_bio2.getvalue()
-
-        st.success("🎉 **Complete!** (with highlight on empty helper attributes)")
+        highlight_cols = {c - 1 for c in helper_cols_idx if 1 <= c <= used_cols}
+        out_bytes_final, highlighted = fast_patch_template(master_bytes=master_bytes, sheet_name=MASTER_TEMPLATE_SHEET,
+                                              header_row=MASTER_DISPLAY_ROW, start_row=MASTER_DATA_START_ROW,
+                                              used_cols=used_cols, block_cols=block_cols, n_rows=n_rows,
+                                              highlight_cols=highlight_cols)
+
+        if highlighted: st.success("🎉 **Complete!** (with highlight on empty helper attributes)")
+        else:
+            st.success("🎉 **Complete!**")
+            if highlight_cols: st.warning("⚠️ Highlight on empty helper attributes was skipped: the template's styles could not be patched.")
         final_base = safe_filename(final_name_input, fallback="target_final_masterfile")
         final_filename = f"{final_base}{ext}"
         st.download_button("⬇️ Download Final Masterfile", data=out_bytes_final, file_name=final_filename,